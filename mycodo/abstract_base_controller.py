@@ -297,3 +297,6 @@ class AbstractBaseController(object):
 
     def lock_release(self, lockfile):
         self.lockfile.lock_release(lockfile)
+
+    def lock_release_all(self, lockfiles):
+        self.lockfile.lock_release_all(lockfiles)
@@ -20,7 +20,6 @@
 #  along with Mycodo. If not, see <http://www.gnu.org/licenses/>.
 #
 #  Contact at kylegabriel.com
-import datetime
 import threading
 import time
 import timeit
@@ -101,7 +100,7 @@ class OutputController(AbstractController, threading.Thread):
             for each_channel in self.output_unique_id[output_id]:
                 # Execute if past the time the output was supposed to turn off
                 if (self.output[output_id].output_setup and
-                        self.output[output_id].output_on_until[each_channel] < datetime.datetime.now() and
+                        self.output[output_id].output_on_until[each_channel] < time.monotonic() and
                         self.output[output_id].output_on_duration[each_channel] and
                         not self.output[output_id].output_off_triggered[each_channel]):
 
@@ -110,7 +109,7 @@ class OutputController(AbstractController, threading.Thread):
                     turn_output_off = threading.Thread(
                         target=self.output[output_id].output_on_off,
                         args=('off',),
-                        kwargs={'output_channel': each_channel})
+                        kwargs={'output_channel': each_channel, 'auto_off': True})
                     turn_output_off.start()
 
     def run_finally(self):
@@ -69,6 +69,7 @@ from mycodo.databases.models import PID
 from mycodo.databases.models import Trigger
 from mycodo.databases.utils import session_scope
 from mycodo.devices.camera import camera_record
+from mycodo.outputs.base_output import invalidate_trigger_cache
 from mycodo.utils.functions import parse_function_information
 from mycodo.utils.database import db_retrieve_table_daemon
 from mycodo.utils.function_actions import get_condition_value
@@ -250,6 +251,8 @@ class DaemonController:
         :type cont_id: str
         """
         cont_type = self.determine_controller_type(cont_id)
+        if cont_type == 'Trigger':
+            invalidate_trigger_cache()
         try:
             if cont_id in self.controller[cont_type]:
                 if self.controller[cont_type][cont_id].is_running():
@@ -331,6 +334,8 @@ class DaemonController:
         :type cont_id: str
         """
         cont_type = self.determine_controller_type(cont_id)
+        if cont_type == 'Trigger':
+            invalidate_trigger_cache()
         try:
             if cont_id in self.controller[cont_type]:
                 if self.controller[cont_type][cont_id].is_running():
@@ -676,6 +681,7 @@ class DaemonController:
             self.logger.exception(message)
 
     def refresh_daemon_trigger_settings(self, unique_id):
+        invalidate_trigger_cache()
         try:
             return self.controller['Trigger'][unique_id].refresh_settings()
         except Exception as except_msg:
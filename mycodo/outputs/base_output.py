@@ -8,29 +8,172 @@ Output.
 All Outputs should inherit from this class and overwrite methods that raise
 NotImplementedErrors
 """
+import atexit
 import datetime
 import logging
+import operator
+import queue
 import threading
 import time
 import timeit
 
 from sqlalchemy import and_
-from sqlalchemy import or_
 
 from mycodo.abstract_base_controller import AbstractBaseController
 from mycodo.databases.models import OutputChannel
 from mycodo.databases.models import Trigger
 from mycodo.mycodo_client import DaemonControl
 from mycodo.utils.database import db_retrieve_table_daemon
-from mycodo.utils.influx import write_influxdb_value
+from mycodo.utils.influx import write_influxdb_values_batch
 from mycodo.utils.outputs import output_types
 
+logger = logging.getLogger("mycodo.outputs.base_output")
+
+# Output durations are queued and written to influxdb in batches by a
+# single writer thread, rather than spawning a thread for every write.
+# Queued values are flushed at interpreter exit.
+INFLUX_WRITE_QUEUE_SIZE = 10000
+INFLUX_WRITE_BATCH_SIZE = 500
+INFLUX_FLUSH_TIMEOUT = 10
+_influx_write_queue = queue.Queue(maxsize=INFLUX_WRITE_QUEUE_SIZE)
+_influx_write_stop = object()
+_influx_writer = None
+_influx_writer_lock = threading.Lock()
+_influx_queue_full = False
+
+
+def _influx_write_loop():
+    """ Drain the write queue, sending queued entries to influxdb in batches """
+    stop = False
+    while not stop:
+        batch = [_influx_write_queue.get()]
+        while len(batch) < INFLUX_WRITE_BATCH_SIZE:
+            try:
+                batch.append(_influx_write_queue.get(timeout=0.25))
+            except queue.Empty:
+                break
+        if _influx_write_stop in batch:
+            stop = True
+            batch = [entry for entry in batch if entry is not _influx_write_stop]
+            while True:
+                try:
+                    batch.append(_influx_write_queue.get_nowait())
+                except queue.Empty:
+                    break
+        if not batch:
+            continue
+        try:
+            write_influxdb_values_batch(batch)
+        except Exception:
+            logger.exception("Error writing batch of {} values to influxdb".format(len(batch)))
+
+
+def _influx_write_flush():
+    """ Stop the writer thread, waiting a bounded time for queued values to be written """
+    if _influx_writer is None or not _influx_writer.is_alive():
+        return
+    try:
+        _influx_write_queue.put(_influx_write_stop, timeout=INFLUX_FLUSH_TIMEOUT)
+    except queue.Full:
+        logger.error("Influxdb write queue full at exit. Queued values may be lost")
+        return
+    _influx_writer.join(INFLUX_FLUSH_TIMEOUT)
+    if _influx_writer.is_alive():
+        logger.error("Timed out writing queued values to influxdb at exit")
+
+
+def _influx_writer_start():
+    """ Start the writer thread on first use """
+    global _influx_writer
+    with _influx_writer_lock:
+        if _influx_writer is None:
+            _influx_writer = threading.Thread(
+                target=_influx_write_loop, name='influx-write', daemon=True)
+            _influx_writer.start()
+            atexit.register(_influx_write_flush)
+
+
+def queue_influxdb_value(unique_id, unit, value, measure=None, channel=None, timestamp=None):
+    """ Queue a value to be written to influxdb by the writer thread """
+    global _influx_queue_full
+    if _influx_writer is None:
+        _influx_writer_start()
+    try:
+        _influx_write_queue.put_nowait(
+            (unique_id, unit, value,
+             {'measure': measure, 'channel': channel, 'timestamp': timestamp}))
+        _influx_queue_full = False
+    except queue.Full:
+        if not _influx_queue_full:
+            _influx_queue_full = True
+            logger.error(
+                "Influxdb write queue full. Discarding values until "
+                "the queue drains (first discarded ID {})".format(unique_id))
+
+
+# Values accepted as the state argument of output_on_off()
+STATES_ON = frozenset(('on', 1, True))
+STATES_OFF = frozenset(('off', 0, False))
+
+# Output Triggers are cached per output channel. The cache is invalidated
+# when the version is bumped (Trigger activated, deactivated, or modified)
+# or after TRIGGER_CACHE_TTL seconds.
+TRIGGER_CACHE_TTL = 30
+TRIGGER_ON_STATES = [
+    'on_duration_none',
+    'on_duration_any',
+    'on_duration_none_any',
+    'on_duration_equal',
+    'on_duration_greater_than',
+    'on_duration_equal_greater_than',
+    'on_duration_less_than',
+    'on_duration_equal_less_than'
+]
+# Comparisons of the amount an output was turned on for with a Trigger's duration
+TRIGGER_ON_DURATION_COMPARE = {
+    'on_duration_greater_than': operator.gt,
+    'on_duration_equal_greater_than': operator.ge,
+    'on_duration_less_than': operator.lt,
+    'on_duration_equal_less_than': operator.le
+}
+_trigger_cache_version = 0
+_outputs_with_triggers = set()
+_outputs_with_triggers_cached = (None, 0.0)
+
+
+def invalidate_trigger_cache():
+    """ Force the Output Triggers to be queried from the database on next use """
+    global _trigger_cache_version
+    _trigger_cache_version += 1
+
+
+def outputs_with_triggers():
+    """ Return the set of Output IDs that have at least one activated Output Trigger """
+    global _outputs_with_triggers
+    global _outputs_with_triggers_cached
+    now = time.monotonic()
+    # Read the version before querying, so an invalidation during the
+    # query forces the next call to refill
+    version = _trigger_cache_version
+    cached_version, timestamp = _outputs_with_triggers_cached
+    if cached_version == version and now - timestamp < TRIGGER_CACHE_TTL:
+        return _outputs_with_triggers
+
+    output_ids = db_retrieve_table_daemon(Trigger).with_entities(Trigger.unique_id_1).filter(
+        and_(Trigger.trigger_type.in_(['trigger_output', 'trigger_output_pwm']),
+             Trigger.is_activated == True)).yield_per(64)
+    _outputs_with_triggers = set(each_row[0] for each_row in output_ids)
+    _outputs_with_triggers_cached = (version, now)
+    return _outputs_with_triggers
+
 
 class AbstractOutput(AbstractBaseController):
     """
     Base Output class that ensures certain methods and values are present
     in outputs.
     """
+    _trigger_cache = {}
+
     def __init__(self, output, testing=False, name=__name__):
         if not testing:
             super(AbstractOutput, self).__init__(output.unique_id, testing=testing, name=__name__)
@@ -46,6 +189,7 @@ class AbstractOutput(AbstractBaseController):
 
         self.OUTPUT_INFORMATION = None
         self.output_time_turned_on = {}
+        self.output_time_turned_on_mono = {}
         self.output_on_duration = {}
         self.output_last_duration = {}
         self.output_on_until = {}
@@ -55,6 +199,7 @@ class AbstractOutput(AbstractBaseController):
 
         self.output = output
         self.running = True
+        self.state_lock = threading.RLock()
 
         if not testing:
             self.output_types = output_types()
@@ -63,10 +208,6 @@ class AbstractOutput(AbstractBaseController):
             self.output_type = self.output.output_type
             self.output_force_command = self.output.force_command
 
-    def __iter__(self):
-        """ Support the iterator protocol """
-        return self
-
     def __repr__(self):
         """  Representation of object """
         return_str = '<{cls}'.format(cls=type(self).__name__)
@@ -111,11 +252,10 @@ class AbstractOutput(AbstractBaseController):
         self.running = False
         try:
             # Release all locks
-            for lockfile, lock_state in self.lockfile.locked.items():
-                if lock_state:
-                    self.lock_release(lockfile)
-        except:
-            pass
+            self.lock_release_all(
+                [lockfile for lockfile, lock_state in self.lockfile.locked.items() if lock_state])
+        except Exception:
+            self.logger.exception("Could not release locks")
 
     #
     # Do not overwrite the function below
@@ -141,22 +281,46 @@ class AbstractOutput(AbstractBaseController):
     def setup_on_off_output(self, output_information):
         self.OUTPUT_INFORMATION = output_information
         self.output_time_turned_on = {}
+        self.output_time_turned_on_mono = {}
         self.output_on_duration = {}
         self.output_last_duration = {}
         self.output_on_until = {}
         self.output_off_until = {}
         self.output_off_triggered = {}
         self.output_states = {}
+        self.output_duration_measurement = {}
 
         for each_output_channel in output_information['channels_dict']:
             self.output_states[each_output_channel] = None
             self.output_time_turned_on[each_output_channel] = None
+            self.output_time_turned_on_mono[each_output_channel] = None
             self.output_on_duration[each_output_channel] = False
             self.output_last_duration[each_output_channel] = 0
-            self.output_on_until[each_output_channel] = datetime.datetime.now()
-            self.output_off_until[each_output_channel] = 0
+            self.output_on_until[each_output_channel] = 0.0
+            self.output_off_until[each_output_channel] = 0.0
             self.output_off_triggered[each_output_channel] = False
 
+            # Determine which measurement of the output channel is a duration
+            self.output_duration_measurement[each_output_channel] = None
+            if 'measurements_dict' in output_information:
+                measurement_channels = output_information['channels_dict'][each_output_channel].get('measurements', [])
+                for each_measure_channel in measurement_channels:
+                    if output_information['measurements_dict'][each_measure_channel]['unit'] == 's':
+                        self.output_duration_measurement[each_output_channel] = each_measure_channel
+                        break
+
+        # The output types this output supports don't change, so determine
+        # them once rather than on every call to output_on_off()
+        self.supports_volume = self.output_type in self.output_types['volume']
+        self.supports_pwm = self.output_type in self.output_types['pwm']
+        self.supports_on_off = self.output_type in self.output_types['on_off']
+
+        self.output_on_handlers = {'sec': self.output_on_sec, None: self.output_on_sec}
+        if self.supports_volume:
+            self.output_on_handlers['vol'] = self.output_on_volume
+        if self.supports_pwm:
+            self.output_on_handlers['pwm'] = self.output_on_pwm
+
     def shutdown(self, shutdown_timer):
         self.stop_output()
         self.logger.info("Stopped in {:.1f} ms".format(
@@ -168,7 +332,8 @@ class AbstractOutput(AbstractBaseController):
                       output_type=None,
                       amount=0.0,
                       min_off=0.0,
-                      trigger_conditionals=True):
+                      trigger_conditionals=True,
+                      auto_off=False):
         """
         Manipulate an output by passing on/off, a volume, or a PWM duty cycle
         to the output module.
@@ -185,384 +350,434 @@ class AbstractOutput(AbstractBaseController):
         :type min_off: float
         :param trigger_conditionals: Whether to allow trigger conditionals to act or not
         :type trigger_conditionals: bool
+        :param auto_off: Only turn off if the on duration has elapsed (used by the output controller)
+        :type auto_off: bool
         """
         msg = ''
 
-        self.logger.debug("output_on_off({}, {}, {}, {}, {}, {})".format(
+        self.logger.debug(
+            "output_on_off(%s, %s, %s, %s, %s, %s)",
             state,
             output_channel,
             output_type,
             amount,
             min_off,
-            trigger_conditionals))
+            trigger_conditionals)
 
-        if state not in ['on', 1, True, 'off', 0, False]:
+        try:
+            state = 'on' if state in STATES_ON else 'off' if state in STATES_OFF else None
+        except TypeError:  # Unhashable state
+            state = None
+        if state is None:
             return 1, 'state not "on", 1, True, "off", 0, or False'
-        elif state in ['on', 1, True]:
-            state = 'on'
-        elif state in ['off', 0, False]:
-            state = 'off'
-
-        current_time = datetime.datetime.now()
 
         if amount is None:
             amount = 0
 
-        output_is_on = self.is_on(output_channel)
+        # Prevent the output state from being changed by multiple threads at
+        # once. Triggers are checked after the lock has been released.
+        with self.state_lock:
+            # Deadlines (output_on_until, output_off_until) are monotonic times
+            current_time = time.monotonic()
+
+            output_is_on = self.is_on(output_channel)
+
+            # Check if output channel exists
+            if output_channel not in self.output_states:
+                msg = "Cannot manipulate Output {id}: output channel doesn't exist: {ch}".format(
+                    id=self.unique_id, ch=output_channel)
+                self.logger.error(msg)
+                return 1, msg
+
+            # Check if output is set up
+            if not self.is_setup():
+                msg = "Cannot manipulate Output {id}: Output not set up.".format(id=self.unique_id)
+                self.logger.error(msg)
+                return 1, msg
+
+            #
+            # Signaled to turn output on
+            #
+            if state == 'on':
+
+                # Checks if device is not on and is instructed to turn on
+                if (output_type == 'on_off' and
+                        'output_types' in self.OUTPUT_INFORMATION and
+                        not output_is_on):
+
+                    # Check if time is greater than off_until to allow an output on.
+                    # If the output is supposed to be off for a minimum duration and that amount
+                    # of time has not passed, do not allow the output to be turned on.
+                    off_until = self.output_off_until[output_channel]
+                    if off_until > current_time:
+                        off_seconds = off_until - current_time
+                        msg = "Output {id} CH{ch} ({name}) instructed to turn on, " \
+                              "however the output has been instructed to stay " \
+                              "off for {off_sec:.2f} more seconds.".format(
+                                id=self.unique_id,
+                                ch=output_channel,
+                                name=self.output_name,
+                                off_sec=off_seconds)
+                        self.logger.debug(msg)
+                        return 1, msg
+
+                # Turn on using the handler for the output type (volume, PWM duty cycle, or duration)
+                if output_type in self.output_on_handlers:
+                    ret, msg = self.output_on_handlers[output_type](
+                        output_channel, amount, min_off, current_time, output_is_on)
+                    if ret is not None:
+                        return ret, msg
+
+            #
+            # Signaled to turn output off
+            #
+            elif state == 'off':
+                # The duration may have been extended since the auto-off was scheduled
+                if auto_off and not (self.output_on_duration[output_channel] and
+                                     self.output_on_until[output_channel] <= current_time):
+                    self.output_off_triggered[output_channel] = False
+                    msg = "Output {id} CH{ch} ({name}) auto-off cancelled: on duration changed".format(
+                        id=self.unique_id, ch=output_channel, name=self.output_name)
+                    self.logger.debug(msg)
+                    return 0, msg
+
+                msg = self.output_turn_off(output_channel, output_type, current_time)
 
-        # Check if output channel exists
-        if output_channel not in self.output_states:
-            msg = "Cannot manipulate Output {id}: output channel doesn't exist: {ch}".format(
-                id=self.unique_id, ch=output_channel)
-            self.logger.error(msg)
-            return 1, msg
+        if trigger_conditionals and self.unique_id in outputs_with_triggers():
+            self.check_triggers(self.unique_id, amount=amount, output_channel=output_channel)
 
-        # Check if output is set up
-        if not self.is_setup():
-            msg = "Cannot manipulate Output {id}: Output not set up.".format(id=self.unique_id)
-            self.logger.error(msg)
-            return 1, msg
+        return 0, msg
 
-        #
-        # Signaled to turn output on
-        #
-        if state == 'on':
-
-            # Checks if device is not on and is instructed to turn on
-            if (output_type == 'on_off' and
-                    'output_types' in self.OUTPUT_INFORMATION and
-                    not output_is_on):
-
-                # Check if time is greater than off_until to allow an output on.
-                # If the output is supposed to be off for a minimum duration and that amount
-                # of time has not passed, do not allow the output to be turned on.
-                off_until_datetime = self.output_off_until[self.unique_id][output_channel]
-                if off_until_datetime and off_until_datetime > current_time:
-                    off_seconds = (off_until_datetime - current_time).total_seconds()
-                    msg = "Output {id} CH{ch} ({name}) instructed to turn on, " \
-                          "however the output has been instructed to stay " \
-                          "off for {off_sec:.2f} more seconds.".format(
-                            id=self.unique_id,
-                            ch=output_channel,
-                            name=self.output_name,
-                            off_sec=off_seconds)
-                    self.logger.debug(msg)
-                    return 1, msg
+    #
+    # Output type handlers used by output_on_off(). Each returns (ret, msg),
+    # where ret is None if output_on_off() should continue and check Triggers,
+    # otherwise output_on_off() returns (ret, msg) immediately.
+    #
+
+    def output_on_volume(self, output_channel, amount, min_off, current_time, output_is_on):
+        """ Output type: Volume, set amount """
+        self.output_switch(
+            'on',
+            output_type='vol',
+            amount=amount,
+            output_channel=output_channel)
+
+        msg = "Command sent: Output {id} CH{ch} ({name}) volume: {v:.1f} ".format(
+            id=self.unique_id,
+            ch=output_channel,
+            name=self.output_name,
+            v=amount)
+        return None, msg
+
+    def output_on_pwm(self, output_channel, amount, min_off, current_time, output_is_on):
+        """ Output type: PWM, set duty cycle """
+        out_ret = self.output_switch(
+            'on',
+            output_type='pwm',
+            amount=amount,
+            output_channel=output_channel)
+
+        msg = "Command sent: Output {id} CH{ch} ({name}) duty cycle: {dc:.2f} %. Output returned: {ret}".format(
+            id=self.unique_id,
+            ch=output_channel,
+            name=self.output_name,
+            dc=amount,
+            ret=out_ret)
+        return None, msg
+
+    def output_on_sec(self, output_channel, amount, min_off, current_time, output_is_on):
+        """ Output type: On/Off, turn on for a duration or indefinitely """
+        msg = ''
+
+        # Set duration for on state
+        if self.supports_on_off and amount != 0:
+            abs_amount = abs(amount)
+            on_until = current_time + abs_amount
+
+            # If a minimum off duration is set, determine the time the output is allowed to turn on again
+            if min_off:
+                self.output_off_until[output_channel] = on_until + min_off
+
+            # Output is already on for an amount, update duration on with new end time
+            if output_is_on and self.output_on_duration[output_channel]:
+                remaining_time = max(0.0, self.output_on_until[output_channel] - current_time)
+
+                time_on = abs(self.output_last_duration[output_channel]) - remaining_time
+                msg = "Output {id} CH{ch} ({name}) is already on for an " \
+                      "amount of {on:.2f} seconds (with {remain:.2f} " \
+                      "seconds remaining). Recording the amount of time " \
+                      "the output has been on ({beenon:.2f} sec) and " \
+                      "updating the amount to {newon:.2f} " \
+                      "seconds.".format(
+                        id=self.unique_id,
+                        ch=output_channel,
+                        name=self.output_name,
+                        on=abs(self.output_last_duration[output_channel]),
+                        remain=remaining_time,
+                        beenon=time_on,
+                        newon=abs_amount)
+                self.logger.debug(msg)
+                self.output_on_until[output_channel] = on_until
+                self.output_last_duration[output_channel] = amount
+
+                # Write the amount the output was ON to the
+                # database at the timestamp it turned ON
+                if time_on > 0:
+                    # Make sure the recorded value is recorded negative
+                    # if instructed to do so
+                    if self.output_last_duration[output_channel] < 0:
+                        duration_on = float(-time_on)
+                    else:
+                        duration_on = float(time_on)
+                    timestamp = datetime.datetime.utcnow() - datetime.timedelta(seconds=abs(duration_on))
+
+                    queue_influxdb_value(
+                        self.unique_id, 's', duration_on,
+                        measure='duration_time',
+                        channel=output_channel,
+                        timestamp=timestamp)
+
+                return 0, msg
+
+            # Output is on, but not for an amount
+            elif output_is_on and not self.output_on_duration[output_channel]:
+
+                self.output_on_duration[output_channel] = True
+                self.output_on_until[output_channel] = on_until
+                self.output_last_duration[output_channel] = amount
+                msg = "Output {id} CH{ch} ({name}) is currently on without an " \
+                      "amount. Turning into an amount of {dur:.1f} " \
+                      "seconds.".format(
+                        id=self.unique_id,
+                        ch=output_channel,
+                        name=self.output_name,
+                        dur=abs_amount)
+                self.logger.debug(msg)
+                return 0, msg
 
-            # Output type: Volume, set amount
-            if output_type == 'vol' and self.output_type in self.output_types['volume']:
-                self.output_switch(
-                    'on',
-                    output_type='vol',
-                    amount=amount,
-                    output_channel=output_channel)
+            # Output is not already on
+            else:
+                out_ret = self.output_switch(
+                    'on', output_type='sec', amount=amount, output_channel=output_channel)
 
-                msg = "Command sent: Output {id} CH{ch} ({name}) volume: {v:.1f} ".format(
+                msg = "Output {id} CH{ch} ({name}) on for {dur:.1f} " \
+                      "seconds. Output returned: {ret}".format(
+                        id=self.unique_id,
+                        ch=output_channel,
+                        name=self.output_name,
+                        dur=abs_amount,
+                        ret=out_ret)
+                self.logger.debug(msg)
+
+                self.output_on_until[output_channel] = on_until
+                self.output_last_duration[output_channel] = amount
+                self.output_on_duration[output_channel] = True
+
+        # No duration specific, so just turn output on
+        elif ('output_types' in self.OUTPUT_INFORMATION and
+                'on_off' in self.OUTPUT_INFORMATION['output_types'] and
+                amount in [None, 0]):
+
+            # Don't turn on if already on, except if it can be forced on
+            if output_is_on and not self.output_force_command:
+                msg = "Output {id} CH{ch} ({name}) is already on.".format(
                     id=self.unique_id,
                     ch=output_channel,
-                    name=self.output_name,
-                    v=amount)
+                    name=self.output_name)
+                self.logger.debug(msg)
+                return 1, msg
+            else:
+                # Record the time the output was turned on in order to
+                # calculate and log the total amount is was on, when
+                # it eventually turns off.
+                if not self.output_time_turned_on[output_channel]:
+                    self.output_time_turned_on[output_channel] = datetime.datetime.now()
+                    self.output_time_turned_on_mono[output_channel] = current_time
 
-            # Output type: PWM, set duty cycle
-            elif output_type == 'pwm' and self.output_type in self.output_types['pwm']:
-                out_ret = self.output_switch(
-                    'on',
-                    output_type='pwm',
-                    amount=amount,
-                    output_channel=output_channel)
+                ret_value = self.output_switch('on', output_channel=output_channel, output_type='sec')
 
-                msg = "Command sent: Output {id} CH{ch} ({name}) duty cycle: {dc:.2f} %. Output returned: {ret}".format(
+                msg = "Output {id} CH{ch} ({name}) ON at {timeon}. Output returned: {ret}".format(
                     id=self.unique_id,
                     ch=output_channel,
                     name=self.output_name,
-                    dc=amount,
-                    ret=out_ret)
-
-            # Output type: On/Off, set duration for on state
-            elif (output_type in ['sec', None] and
-                    self.output_type in self.output_types['on_off'] and
-                    amount != 0):
-                # If a minimum off duration is set, determine the time the output is allowed to turn on again
-                if min_off:
-                    self.output_off_until[output_channel] = (
-                        current_time + datetime.timedelta(seconds=abs(amount) + min_off))
-
-                # Output is already on for an amount, update duration on with new end time
-                if output_is_on and self.output_on_duration[output_channel]:
-                    if self.output_on_until[output_channel] > current_time:
-                        remaining_time = (
-                            self.output_on_until[output_channel] - current_time).total_seconds()
-                    else:
-                        remaining_time = 0
-
-                    time_on = abs(self.output_last_duration[output_channel]) - remaining_time
-                    msg = "Output {id} CH{ch} ({name}) is already on for an " \
-                          "amount of {on:.2f} seconds (with {remain:.2f} " \
-                          "seconds remaining). Recording the amount of time " \
-                          "the output has been on ({beenon:.2f} sec) and " \
-                          "updating the amount to {newon:.2f} " \
-                          "seconds.".format(
-                            id=self.unique_id,
-                            ch=output_channel,
-                            name=self.output_name,
-                            on=abs(self.output_last_duration[output_channel]),
-                            remain=remaining_time,
-                            beenon=time_on,
-                            newon=abs(amount))
-                    self.logger.debug(msg)
-                    self.output_on_until[output_channel] = (
-                        current_time + datetime.timedelta(seconds=abs(amount)))
-                    self.output_last_duration[output_channel] = amount
-
-                    # Write the amount the output was ON to the
-                    # database at the timestamp it turned ON
-                    if time_on > 0:
-                        # Make sure the recorded value is recorded negative
-                        # if instructed to do so
-                        if self.output_last_duration[output_channel] < 0:
-                            duration_on = float(-time_on)
-                        else:
-                            duration_on = float(time_on)
-                        timestamp = datetime.datetime.utcnow() - datetime.timedelta(seconds=abs(duration_on))
-
-                        write_db = threading.Thread(
-                            target=write_influxdb_value,
-                            args=(self.unique_id,
-                                  's',
-                                  duration_on,),
-                            kwargs={'measure': 'duration_time',
-                                    'channel': output_channel,
-                                    'timestamp': timestamp})
-                        write_db.start()
+                    timeon=self.output_time_turned_on[output_channel],
+                    ret=ret_value)
+                self.logger.debug(msg)
+
+        return None, msg
+
+    def output_turn_off(self, output_channel, output_type, current_time):
+        """ Turn an output off and record the duration it was on for """
+        ret_value = self.output_switch('off', output_type=output_type, output_channel=output_channel)
+
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        msg = "Output {id} CH{ch} ({name}) OFF at {timeoff}. Output returned: {ret}".format(
+            id=self.unique_id,
+            ch=output_channel,
+            name=self.output_name,
+            timeoff=timestamp,
+            ret=ret_value)
+        self.logger.debug(msg)
+
+        # Write output amount to database
+        if (self.output_time_turned_on[output_channel] is not None or
+                self.output_on_duration[output_channel]):
+            duration_sec = None
+            timestamp = None
 
-                    return 0, msg
+            if self.output_on_duration[output_channel]:
+                remaining_time = max(0.0, self.output_on_until[output_channel] - current_time)
+                duration_sec = (abs(self.output_last_duration[output_channel]) - remaining_time)
+                timestamp = (datetime.datetime.utcnow() - datetime.timedelta(seconds=duration_sec))
 
-                # Output is on, but not for an amount
-                elif output_is_on and not self.output_on_duration[output_channel]:
-
-                    self.output_on_duration[output_channel] = True
-                    self.output_on_until[output_channel] = (
-                        current_time + datetime.timedelta(seconds=abs(amount)))
-                    self.output_last_duration[output_channel] = amount
-                    msg = "Output {id} CH{ch} ({name}) is currently on without an " \
-                          "amount. Turning into an amount of {dur:.1f} " \
-                          "seconds.".format(
-                            id=self.unique_id,
-                            ch=output_channel,
-                            name=self.output_name,
-                            dur=abs(amount))
-                    self.logger.debug(msg)
-                    return 0, msg
+                # Store negative amount if a negative amount is received
+                if self.output_last_duration[output_channel] < 0:
+                    duration_sec = -duration_sec
 
-                # Output is not already on
-                else:
-                    out_ret = self.output_switch(
-                        'on', output_type='sec', amount=amount, output_channel=output_channel)
-
-                    msg = "Output {id} CH{ch} ({name}) on for {dur:.1f} " \
-                          "seconds. Output returned: {ret}".format(
-                            id=self.unique_id,
-                            ch=output_channel,
-                            name=self.output_name,
-                            dur=abs(amount),
-                            ret=out_ret)
-                    self.logger.debug(msg)
+                self.output_on_duration[output_channel] = False
+                self.output_on_until[output_channel] = current_time
 
-                    self.output_on_until[output_channel] = (
-                        current_time + datetime.timedelta(seconds=abs(amount)))
-                    self.output_last_duration[output_channel] = amount
-                    self.output_on_duration[output_channel] = True
+            if self.output_time_turned_on[output_channel] is not None:
+                # Write the amount the output was ON to the database
+                # at the timestamp it turned ON
+                duration_sec = current_time - self.output_time_turned_on_mono[output_channel]
+                timestamp = datetime.datetime.utcnow() - datetime.timedelta(seconds=duration_sec)
+                self.output_time_turned_on[output_channel] = None
+                self.output_time_turned_on_mono[output_channel] = None
 
-            # No duration specific, so just turn output on
-            elif ('output_types' in self.OUTPUT_INFORMATION and
-                    'on_off' in self.OUTPUT_INFORMATION['output_types'] and
-                    amount in [None, 0] and
-                    output_type in ['sec', None]):
+            queue_influxdb_value(
+                self.unique_id, 's', duration_sec,
+                measure='duration_time',
+                channel=self.output_duration_measurement[output_channel],
+                timestamp=timestamp)
 
-                # Don't turn on if already on, except if it can be forced on
-                if output_is_on and not self.output_force_command:
-                    msg = "Output {id} CH{ch} ({name}) is already on.".format(
-                        id=self.unique_id,
-                        ch=output_channel,
-                        name=self.output_name)
-                    self.logger.debug(msg)
-                    return 1, msg
-                else:
-                    # Record the time the output was turned on in order to
-                    # calculate and log the total amount is was on, when
-                    # it eventually turns off.
-                    if not self.output_time_turned_on[output_channel]:
-                        self.output_time_turned_on[output_channel] = current_time
+        self.output_off_triggered[output_channel] = False
 
-                    ret_value = self.output_switch('on', output_channel=output_channel, output_type='sec')
+        return msg
 
-                    msg = "Output {id} CH{ch} ({name}) ON at {timeon}. Output returned: {ret}".format(
-                        id=self.unique_id,
-                        ch=output_channel,
-                        name=self.output_name,
-                        timeon=self.output_time_turned_on[output_channel],
-                        ret=ret_value)
-                    self.logger.debug(msg)
+    def get_triggers(self, output_id, output_channel=0):
+        """
+        Return the activated Output Triggers for an output channel, partitioned
+        into on, off, and PWM Triggers. Results are cached for up to
+        TRIGGER_CACHE_TTL seconds or until invalidate_trigger_cache() is called.
 
-        #
-        # Signaled to turn output off
-        #
-        elif state == 'off':
-
-            ret_value = self.output_switch('off', output_type=output_type, output_channel=output_channel)
-
-            timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-            msg = "Output {id} CH{ch} ({name}) OFF at {timeoff}. Output returned: {ret}".format(
-                id=self.unique_id,
-                ch=output_channel,
-                name=self.output_name,
-                timeoff=timestamp,
-                ret=ret_value)
-            self.logger.debug(msg)
-
-            # Write output amount to database
-            if (self.output_time_turned_on[output_channel] is not None or
-                    self.output_on_duration[output_channel]):
-                duration_sec = None
-                timestamp = None
-
-                if self.output_on_duration[output_channel]:
-                    remaining_time = 0
-                    if self.output_on_until[output_channel] > current_time:
-                        remaining_time = (
-                            self.output_on_until[output_channel] - current_time).total_seconds()
-                    duration_sec = (abs(self.output_last_duration[output_channel]) - remaining_time)
-                    timestamp = (datetime.datetime.utcnow() - datetime.timedelta(seconds=duration_sec))
-
-                    # Store negative amount if a negative amount is received
-                    if self.output_last_duration[output_channel] < 0:
-                        duration_sec = -duration_sec
-
-                    self.output_on_duration[output_channel] = False
-                    self.output_on_until[output_channel] = current_time
-
-                if self.output_time_turned_on[output_channel] is not None:
-                    # Write the amount the output was ON to the database
-                    # at the timestamp it turned ON
-                    duration_sec = (
-                        current_time - self.output_time_turned_on[output_channel]).total_seconds()
-                    timestamp = datetime.datetime.utcnow() - datetime.timedelta(seconds=duration_sec)
-                    self.output_time_turned_on[output_channel] = None
-
-                # determine which measurement of the output_channel is a duration
-                measurement_channel = None
-                if ('channels_dict' in self.OUTPUT_INFORMATION and
-                        'measurements_dict' in self.OUTPUT_INFORMATION):
-                    measurement_channels = self.OUTPUT_INFORMATION['channels_dict'][output_channel]['measurements']
-                    for each_measure_channel in measurement_channels:
-                        if self.OUTPUT_INFORMATION['measurements_dict'][each_measure_channel]['unit'] == 's':
-                            measurement_channel = each_measure_channel
-                            break
-
-                write_db = threading.Thread(
-                    target=write_influxdb_value,
-                    args=(self.unique_id,
-                          's',
-                          duration_sec,),
-                    kwargs={'measure': 'duration_time',
-                            'channel': measurement_channel,
-                            'timestamp': timestamp})
-                write_db.start()
-
-            self.output_off_triggered[output_channel] = False
-
-        if trigger_conditionals:
-            self.check_triggers(self.unique_id, amount=amount, output_channel=output_channel)
+        :return: (rows_on, rows_off, rows_pwm), or None if the channel doesn't exist
+        :rtype: tuple or None
+        """
+        key = (output_id, output_channel)
+        now = time.monotonic()
+        # Read the version before querying, so an invalidation during the
+        # query forces the next call to refill
+        version = _trigger_cache_version
+        cached = self._trigger_cache.get(key)
+        if (cached is not None and
+                cached[0] == version and
+                now - cached[1] < TRIGGER_CACHE_TTL):
+            return cached[2]
 
-        return 0, msg
+        output_channel_dev = db_retrieve_table_daemon(OutputChannel).filter(
+            and_(OutputChannel.output_id == output_id, OutputChannel.channel == output_channel)).first()
+        if output_channel_dev is None:
+            return None
+
+        # PWM Triggers can only act on outputs that support PWM
+        if self.supports_pwm:
+            trigger_types = ['trigger_output', 'trigger_output_pwm']
+        else:
+            trigger_types = ['trigger_output']
+
+        # Rows are partitioned as they're read, so stream them rather than
+        # materializing the full result first
+        triggers = db_retrieve_table_daemon(Trigger).filter(
+            and_(Trigger.trigger_type.in_(trigger_types),
+                 Trigger.unique_id_1 == output_id,
+                 Trigger.unique_id_2 == output_channel_dev.unique_id,
+                 Trigger.is_activated == True)).yield_per(64)
+
+        rows_on = []
+        rows_off = []
+        rows_pwm = []
+        for each_trigger in triggers:
+            # Short ID used in Trigger messages
+            each_trigger.unique_id_short = each_trigger.unique_id.split('-')[0]
+            if each_trigger.trigger_type == 'trigger_output_pwm':
+                rows_pwm.append(each_trigger)
+            elif each_trigger.output_state == 'off':
+                rows_off.append(each_trigger)
+            elif each_trigger.output_state in TRIGGER_ON_STATES:
+                rows_on.append(each_trigger)
+
+        rows = (rows_on, rows_off, rows_pwm)
+        self._trigger_cache[key] = (version, now, rows)
+        return rows
+
+    @staticmethod
+    def triggers_on_duration_match(triggers, amount):
+        """ Return the on-duration Output Triggers that match the amount the output was turned on for """
+        # States that only depend on the amount are evaluated once, rather than for each Trigger
+        states_amount = {'on_duration_none_any'}
+        if amount == 0.0:
+            states_amount.add('on_duration_none')
+        if amount:
+            states_amount.add('on_duration_any')
+
+        matched = []
+        for each_trigger in triggers:
+            state = each_trigger.output_state
+            duration = each_trigger.output_duration
+            if state in states_amount:
+                matched.append(each_trigger)
+            elif state == 'on_duration_equal':
+                if duration == amount:
+                    matched.append(each_trigger)
+            elif (state in TRIGGER_ON_DURATION_COMPARE and
+                    amount is not None and
+                    duration is not None and
+                    TRIGGER_ON_DURATION_COMPARE[state](amount, duration)):
+                matched.append(each_trigger)
+        return matched
 
     def check_triggers(self, output_id, amount=None, output_channel=0):
         """
         This function is executed whenever an output is turned on or off
         It is responsible for executing Output Triggers
         """
-        output_channel_dev = db_retrieve_table_daemon(OutputChannel).filter(
-            and_(OutputChannel.output_id == output_id, OutputChannel.channel == output_channel)).first()
-        if output_channel_dev is None:
+        triggers = self.get_triggers(output_id, output_channel=output_channel)
+        if triggers is None:
             self.logger.error("Could nto find channel in database")
             return
+        rows_on, rows_off, rows_pwm = triggers
+        if not rows_on and not rows_off and not rows_pwm:
+            return
+
+        # Read the state of the output once, since it's needed by both the
+        # On/Off and PWM checks ("on", "off", or duty cycle)
+        duty_cycle = self.output_state(output_channel)
+
+        # The timestamp and output are the same for every Trigger message
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        output_str = "Output {oid} CH{ch}".format(oid=output_id, ch=output_channel)
 
         #
         # Check On/Off Outputs
         #
-        trigger_output = db_retrieve_table_daemon(Trigger)
-        trigger_output = trigger_output.filter(Trigger.trigger_type == 'trigger_output')
-        trigger_output = trigger_output.filter(Trigger.unique_id_1 == output_id)
-        trigger_output = trigger_output.filter(Trigger.unique_id_2 == output_channel_dev.unique_id)
-        trigger_output = trigger_output.filter(Trigger.is_activated == True)
 
         # Find any Output Triggers with the output_id of the output that
         # just changed its state
-        if self.is_on(output_channel):
-            trigger_output = trigger_output.filter(
-                or_(Trigger.output_state == 'on_duration_none',
-                    Trigger.output_state == 'on_duration_any',
-                    Trigger.output_state == 'on_duration_none_any',
-                    Trigger.output_state == 'on_duration_equal',
-                    Trigger.output_state == 'on_duration_greater_than',
-                    Trigger.output_state == 'on_duration_equal_greater_than',
-                    Trigger.output_state == 'on_duration_less_than',
-                    Trigger.output_state == 'on_duration_equal_less_than'))
-
-            on_duration_none = and_(
-                Trigger.output_state == 'on_duration_none',
-                amount == 0.0)
-
-            on_duration_any = and_(
-                Trigger.output_state == 'on_duration_any',
-                bool(amount))
-
-            on_duration_none_any = Trigger.output_state == 'on_duration_none_any'
-
-            on_duration_equal = and_(
-                Trigger.output_state == 'on_duration_equal',
-                Trigger.output_duration == amount)
-
-            on_duration_greater_than = and_(
-                Trigger.output_state == 'on_duration_greater_than',
-                amount > Trigger.output_duration)
-
-            on_duration_equal_greater_than = and_(
-                Trigger.output_state == 'on_duration_equal_greater_than',
-                amount >= Trigger.output_duration)
-
-            on_duration_less_than = and_(
-                Trigger.output_state == 'on_duration_less_than',
-                amount < Trigger.output_duration)
-
-            on_duration_equal_less_than = and_(
-                Trigger.output_state == 'on_duration_equal_less_than',
-                amount <= Trigger.output_duration)
-
-            trigger_output = trigger_output.filter(
-                or_(on_duration_none,
-                    on_duration_any,
-                    on_duration_none_any,
-                    on_duration_equal,
-                    on_duration_greater_than,
-                    on_duration_equal_greater_than,
-                    on_duration_less_than,
-                    on_duration_equal_less_than))
+        if duty_cycle not in ['off', None]:
+            trigger_output = self.triggers_on_duration_match(rows_on, amount)
         else:
-            trigger_output = trigger_output.filter(
-                Trigger.output_state == 'off')
+            trigger_output = rows_off
 
         # Execute the Trigger Actions for each Output Trigger
         # for this particular Output device
-        for each_trigger in trigger_output.all():
-            timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-            message = "{ts}\n[Trigger {cid} ({cname})] Output {oid} CH{ch} ({name}) {state}".format(
+        for each_trigger in trigger_output:
+            message = "{ts}\n[Trigger {cid} ({cname})] {output} ({name}) {state}".format(
                 ts=timestamp,
-                cid=each_trigger.unique_id.split('-')[0],
+                cid=each_trigger.unique_id_short,
                 cname=each_trigger.name,
                 name=each_trigger.name,
-                oid=output_id,
-                ch=output_channel,
+                output=output_str,
                 state=each_trigger.output_state)
 
             self.control.trigger_all_actions(
@@ -571,17 +786,11 @@ class AbstractOutput(AbstractBaseController):
         #
         # Check PWM Outputs
         #
-        trigger_output_pwm = db_retrieve_table_daemon(Trigger)
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.trigger_type == 'trigger_output_pwm')
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.unique_id_1 == output_id)
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.unique_id_2 == output_channel_dev.unique_id)
-        trigger_output_pwm = trigger_output_pwm.filter(Trigger.is_activated == True)
 
         # Execute the Trigger Actions for each Output Trigger
         # for this particular Output device
-        for each_trigger in trigger_output_pwm.all():
+        for each_trigger in rows_pwm:
             trigger_trigger = False
-            duty_cycle = self.output_state(output_channel)
 
             if duty_cycle == 'off':
                 if (
@@ -604,15 +813,13 @@ class AbstractOutput(AbstractBaseController):
             if not trigger_trigger:
                 continue
 
-            timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-            message = "{ts}\n[Trigger {cid} ({cname})] Output {oid} CH{ch} " \
+            message = "{ts}\n[Trigger {cid} ({cname})] {output} " \
                       "({name}) Duty Cycle {actual_dc} {state} {duty_cycle}".format(
                         ts=timestamp,
-                        cid=each_trigger.unique_id.split('-')[0],
+                        cid=each_trigger.unique_id_short,
                         cname=each_trigger.name,
                         name=each_trigger.name,
-                        oid=output_id,
-                        ch=output_channel,
+                        output=output_str,
                         actual_dc=duty_cycle,
                         state=each_trigger.output_state,
                         duty_cycle=each_trigger.output_duty_cycle)
@@ -624,17 +831,13 @@ class AbstractOutput(AbstractBaseController):
         """ Return how many seconds an output has been currently on for """
         if not self.is_on(output_channel):
             return 0
-        else:
-            now = datetime.datetime.now()
-            sec_currently_on = 0
-            if self.output_on_duration[output_channel]:
-                left = 0
-                if self.output_on_until[output_channel] > now:
-                    left = (self.output_on_until[output_channel] - now).total_seconds()
-                sec_currently_on = abs(self.output_last_duration[output_channel]) - left
-            elif self.output_time_turned_on[output_channel]:
-                sec_currently_on = (now - self.output_time_turned_on[output_channel]).total_seconds()
-            return sec_currently_on
+        now = time.monotonic()
+        if self.output_on_duration[output_channel]:
+            return abs(self.output_last_duration[output_channel]) - max(
+                0.0, self.output_on_until[output_channel] - now)
+        if self.output_time_turned_on_mono[output_channel] is not None:
+            return now - self.output_time_turned_on_mono[output_channel]
+        return 0
 
     def output_state(self, output_channel):
         """
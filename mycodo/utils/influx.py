@@ -661,6 +661,35 @@ def write_influxdb_value(
             return 1
 
 
+def write_influxdb_values_batch(batch):
+    """
+    Write a batch of values into an Influxdb database with a single request
+
+    example:
+        write_influxdb_values_batch([
+            ('00000001', 's', 15.2, {'measure': 'duration_time', 'channel': 0}),
+            ('00000002', 's', 3.0, {'measure': 'duration_time', 'channel': 1})])
+
+    :return: success (0) or failure (1)
+    :rtype: bool
+
+    :param batch: Entries of the form (unique_id, unit, value, kwargs), where
+        kwargs are passed to format_influxdb_data() (measure, channel, timestamp)
+    :type batch: list of tuples
+    """
+    data = []
+    unique_ids = []
+    for unique_id, unit, value, kwargs in batch:
+        try:
+            data.append(format_influxdb_data(unique_id, unit, value, **kwargs))
+            if unique_id not in unique_ids:
+                unique_ids.append(unique_id)
+        except Exception:
+            logger.exception("Could not format influxdb data for ID {}".format(unique_id))
+
+    return write_influxdb_list(data, ', '.join(unique_ids))
+
+
 def write_influxdb_list(data, unique_id):
     """
     Write an entry into an Influxdb database
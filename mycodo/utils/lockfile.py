@@ -46,11 +46,20 @@ class LockFile:
 
     def lock_release(self, lockfile):
         """ Release lock and force deletion of lock file """
-        try:
-            logger.debug("Releasing lock for {}".format(lockfile))
-            self.lock[lockfile].release(force=True)
-            os.remove(lockfile)
-        except Exception:
-            pass
-        finally:
-            self.locked[lockfile] = False
+        self.lock_release_all([lockfile])
+
+    def lock_release_all(self, lockfiles):
+        """ Release multiple locks and force deletion of their lock files """
+        if not lockfiles:
+            return
+        logger.debug("Releasing locks for {}".format(", ".join(lockfiles)))
+        for lockfile in lockfiles:
+            try:
+                self.lock[lockfile].release(force=True)
+                os.remove(lockfile)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logger.exception("Could not release lock for {}".format(lockfile))
+            finally:
+                self.locked[lockfile] = False
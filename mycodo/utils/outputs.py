@@ -21,7 +21,9 @@
 #
 #  Contact at kylegabriel.com
 
+import functools
 import logging
+import types
 
 import os
 
@@ -170,8 +172,24 @@ def outputs_volume():
 
 
 def output_types():
-    return {
-        'on_off': outputs_on_off(),
-        'pwm': outputs_pwm(),
-        'volume': outputs_volume()
-    }
+    """
+    Return the Output modules of each output type ('on_off', 'pwm', 'volume')
+
+    Parsing the Output modules is expensive, so the result is cached and only
+    rebuilt when the custom outputs directory changes (a module is imported
+    or deleted). The returned mapping is shared and therefore read-only.
+    """
+    try:
+        custom_mtime = os.path.getmtime(PATH_OUTPUTS_CUSTOM)
+    except OSError:
+        custom_mtime = None
+    return _output_types(custom_mtime)
+
+
+@functools.lru_cache(maxsize=1)
+def _output_types(custom_mtime):
+    return types.MappingProxyType({
+        'on_off': tuple(outputs_on_off()),
+        'pwm': tuple(outputs_pwm()),
+        'volume': tuple(outputs_volume())
+    })